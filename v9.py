@@ -1,78 +1,163 @@
 import streamlit as st
 import yfinance as yf
+from yfinance.exceptions import YFException, YFRateLimitError
 import pandas as pd
+import numpy as np
+from numba import njit
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import time
+import random
 
 # --- 頁面配置 ---
 st.set_page_config(page_title="專業級多股實時監控", layout="wide")
 st.title("🚀 專業實時監控 (摘要含量能與趨勢資訊)")
 
 # --- 核心運算函數 ---
-def fetch_data(ticker, interval):
+def download_batch(tickers, interval, attempts=3):
+    # 暫時性失敗以指數退避加隨機抖動重試；遭限流時直接拋出，不再加重請求
+    for attempt in range(attempts):
+        try:
+            data = yf.download(tickers=" ".join(tickers), period="2d", interval=interval,
+                               group_by='ticker', threads=True, progress=False)
+        except OSError:  # curl_cffi 連線錯誤繼承自 OSError
+            if attempt == attempts - 1: raise
+        else:
+            # yf.download 會吞掉各檔例外，只以字串記錄在 yf.shared._ERRORS
+            if any('YFRateLimitError' in err for err in yf.shared._ERRORS.values()):
+                raise YFRateLimitError()
+            if not data.empty or attempt == attempts - 1: return data
+        time.sleep(min(2.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+@st.cache_data(ttl=50, show_spinner=False)
+def fetch_many(tickers, interval):
+    # 單次批次請求下載多檔標的，再依第一層欄位拆分
+    result = {t: None for t in tickers}
+    data = download_batch(tickers, interval)
+    if data.empty: return result
+    for t in tickers:
+        if t not in data.columns.get_level_values(0): continue
+        # 只保留 OHLCV 並降為 float32，減少後續運算的記憶體頻寬
+        df = data[t][['Open', 'High', 'Low', 'Close', 'Volume']].dropna().astype('float32')
+        if not df.empty: result[t] = df
+    return result
+
+def fetch_with_cooldown(tickers, interval, cooldown=180):
+    # 遭限流後冷卻數個刷新週期，期間不發出請求；其餘錯誤視為本輪載入失敗
+    if time.time() < st.session_state.get("fetch_cooldown", 0):
+        return {t: None for t in tickers}
     try:
-        data = yf.download(ticker, period="2d", interval=interval, progress=False)
-        if data.empty: return None
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = data.columns.get_level_values(0)
-        return data
-    except:
-        return None
-
-def calculate_rsi(series, period=14):
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    if loss.iloc[-1] == 0: return 100.0
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
-
-def get_vix_info():
-    vix = fetch_data("^VIX", "2m")
+        return fetch_many(tickers, interval)
+    except YFRateLimitError:
+        st.session_state["fetch_cooldown"] = time.time() + cooldown
+    except (OSError, YFException):
+        pass
+    return {t: None for t in tickers}
+
+@njit(cache=True, fastmath=True)
+def rsi_last(close, period=14):
+    # Wilder 遞迴單次走訪，只回傳最後一筆 RSI 數值
+    if close.size <= period: return 50.0
+    gain = loss = 0.0
+    for i in range(1, period + 1):
+        d = close[i] - close[i - 1]
+        if d > 0: gain += d
+        else: loss -= d
+    gain /= period; loss /= period
+    for i in range(period + 1, close.size):
+        d = close[i] - close[i - 1]
+        g = d if d > 0 else 0.0
+        l = -d if d < 0 else 0.0
+        gain = (gain * (period - 1) + g) / period
+        loss = (loss * (period - 1) + l) / period
+    if loss == 0: return 100.0
+    return 100 - (100 / (1 + gain / loss))
+
+@njit(cache=True, fastmath=True)
+def ewma_last2(x, span_f, span_s):
+    # 單次走訪同時計算快慢 EMA（等同 ewm(adjust=False)），回傳前一根與最後一根的值
+    af, as_ = 2 / (span_f + 1), 2 / (span_s + 1)
+    ef = es = x[0]
+    ef_prev = es_prev = ef
+    for i in range(1, x.size):
+        ef_prev, es_prev = ef, es
+        ef = af * x[i] + (1 - af) * ef
+        es = as_ * x[i] + (1 - as_) * es
+    return ef_prev, es_prev, ef, es
+
+@njit(cache=True, fastmath=True)
+def ewma(x, span):
+    # 完整 EMA 陣列（等同 ewm(adjust=False)），供圖表疊加使用
+    a = 2 / (span + 1)
+    out = np.empty(x.size)
+    out[0] = x[0]
+    for i in range(1, x.size):
+        out[i] = a * x[i] + (1 - a) * out[i - 1]
+    return out
+
+# 匯入時先以假資料觸發 JIT 編譯，避免第一次刷新被編譯時間拖慢
+_warm = np.linspace(1.0, 2.0, 32)
+rsi_last(_warm, 14); ewma_last2(_warm, 9, 21); ewma(_warm, 9)
+
+def get_vix_info(vix):
+    # VIX 與監控標的共用同一批次下載的資料
     if vix is None or len(vix) < 2: return 20.0, 0.0
     curr_v = float(vix['Close'].iloc[-1])
     v_chg = curr_v - float(vix['Close'].iloc[-2])
     return curr_v, v_chg
 
-def analyze_stock(df, v_chg, ema_fast_val, ema_slow_val):
-    if df is None or len(df) < 25: return None, None
+def update_high_low(sym, df):
+    # 區間高低點存於 session_state，每次只掃描上次最後一根之後的K棒；資料窗口起點變動時重新整段計算
+    if df is None: return None, None
+    key = f"hl_{sym}"
+    state = st.session_state.get(key)
+    if state is None or state[2] != df.index[0]:
+        hi, lo, new = -np.inf, np.inf, df
+    else:
+        hi, lo, _, last_ts = state
+        new = df.loc[last_ts:]  # 含上次最後一根，該K棒可能仍在更新
+    hi, lo = max(hi, float(new['High'].max())), min(lo, float(new['Low'].min()))
+    st.session_state[key] = (hi, lo, df.index[0], df.index[-1])
+    return hi, lo
+
+# 以首末 K 棒時間與最新收盤價作為快取鍵，避免雜湊整個 DataFrame
+@st.cache_data(ttl=60, show_spinner=False,
+               hash_funcs={pd.DataFrame: lambda d: (d.index[0].value, d.index[-1].value, float(d['Close'].iloc[-1]))})
+def analyze_stock_summary(df, high_p, low_p, v_chg, ema_fast_val, ema_slow_val):
+    # 只計算摘要卡片所需的純量，不在 df 上新增指標欄位
+    if df is None or len(df) < 25: return None
+
+    # 一次取出 NumPy 陣列，後續純量皆由陣列尾端取得
+    closes, opens, vols = df['Close'].to_numpy(np.float64), df['Open'].to_numpy(), df['Volume'].to_numpy()
+    curr_p, prev_p = float(closes[-1]), float(closes[-2])
+    day_open, curr_vol = float(opens[-1]), float(vols[-1])
     
-    # 1. 支撐壓力計算
-    high_p, low_p, close_p = float(df['High'].max()), float(df['Low'].min()), float(df['Close'].iloc[-1])
-    pivot = (high_p + low_p + close_p) / 3
+    # 1. 支撐壓力計算（區間高低點由 update_high_low 增量維護）
+    pivot = (high_p + low_p + curr_p) / 3
     res_1, sup_1 = (2 * pivot) - low_p, (2 * pivot) - high_p
 
     # 2. 技術指標
-    df['EMA_F'] = df['Close'].ewm(span=ema_fast_val, adjust=False).mean()
-    df['EMA_S'] = df['Close'].ewm(span=ema_slow_val, adjust=False).mean()
-    df['RSI'] = calculate_rsi(df['Close'])
-    df['Vol_MA'] = df['Volume'].rolling(window=10).mean()
-    
-    last, prev = df.iloc[-1], df.iloc[-2]
-    curr_p = float(last['Close'])
-    prev_p = float(prev['Close'])
+    ema_f_prev, ema_s_prev, ema_f, ema_s = ewma_last2(closes, ema_fast_val, ema_slow_val)
+    rsi = rsi_last(closes, 14)
+    vol_ma = float(vols[-10:].mean())  # 近10期均量
     
     # ── 改進版異常偵測 ────────────────
     # 1. 價格瞬間變動（相對前一根K）
     price_chg_pct_1bar   = ((curr_p - prev_p) / prev_p) * 100 if prev_p != 0 else 0
     
     # 2. 當日漲跌幅（相對於今日開盤）
-    day_open             = float(df['Open'].iloc[-1])
     price_chg_pct_day    = ((curr_p - day_open) / day_open) * 100 if day_open != 0 else 0
     
     # 3. 成交量異常倍數（相對於近10期均量）
-    vol_ma               = float(last['Vol_MA'])
-    vol_ratio            = float(last['Volume'] / vol_ma) if vol_ma > 0 else 1.0
+    vol_ratio            = curr_vol / vol_ma if vol_ma > 0 else 1.0
     
     # ── 可自行調整的閾值 ───────────────
-    price_change_pct = ((curr_p - prev_p) / prev_p) * 100
-    is_price_anomaly = abs(price_change_pct) >= 0.5  # 單根 K 線漲跌超過 0.5%
+    is_price_anomaly = abs(price_chg_pct_1bar) >= 0.5  # 單根 K 線漲跌超過 0.5%
     is_vol_anomaly = vol_ratio >= 2.5               # 成交量超過 10 期均值 2.5 倍
     # -----------------------
 
     # 3. 趨勢與量能判斷
-    trend_type = "多頭 (Bullish)" if last['EMA_F'] > last['EMA_S'] else "空頭 (Bearish)"
+    trend_type = "多頭 (Bullish)" if ema_f > ema_s else "空頭 (Bearish)"
     
     # ── 更細緻的異常標籤 ────────────────
     price_alert = ""
@@ -104,10 +189,10 @@ def analyze_stock(df, v_chg, ema_fast_val, ema_slow_val):
     # 優先級判斷：異常提醒 > 交叉提醒
     if is_price_anomaly or is_vol_anomaly:
         msg = f"⚠️ 異常: {'劇烈波動' if is_price_anomaly else ''} {'量能激增' if is_vol_anomaly else ''}"
-        alert_level = "error" if is_price_anomaly and price_change_pct < 0 else "warning"
-    elif prev['EMA_F'] <= prev['EMA_S'] and last['EMA_F'] > last['EMA_S']:
+        alert_level = "error" if is_price_anomaly and price_chg_pct_1bar < 0 else "warning"
+    elif ema_f_prev <= ema_s_prev and ema_f > ema_s:
         msg = "↗️ 黃金交叉"; alert_level = "warning" if v_chg > 0.2 else "error"
-    elif prev['EMA_F'] >= prev['EMA_S'] and last['EMA_F'] < last['EMA_S']:
+    elif ema_f_prev >= ema_s_prev and ema_f < ema_s:
         msg = "↘️ 死亡交叉"; alert_level = "error"
     elif curr_p >= res_1 * 0.998:
         msg = "🧱 接近壓力"; alert_level = "warning"
@@ -116,8 +201,8 @@ def analyze_stock(df, v_chg, ema_fast_val, ema_slow_val):
         "price": curr_p,
         "price_chg_1bar": price_chg_pct_1bar,
         "price_chg_day": price_chg_pct_day,
-        "day_pct": ((curr_p - df['Open'].iloc[-1]) / df['Open'].iloc[-1]) * 100,
-        "rsi": float(last['RSI']),
+        "day_pct": price_chg_pct_day,
+        "rsi": rsi,
         "vol_ratio": vol_ratio,
         "vol_status": vol_status,
         "trend": trend_type,
@@ -125,7 +210,57 @@ def analyze_stock(df, v_chg, ema_fast_val, ema_slow_val):
         "msg": msg, "alert_level": alert_level,
         "anomaly_text": anomaly_text
     }
-    return df, info
+    return info
+
+def compute_plot_series(df, ema_fast_val):
+    # 圖表專用的完整 EMA 陣列，僅在展開圖表時計算，不寫回 df
+    return ewma(df['Close'].to_numpy(np.float64), ema_fast_val)
+
+def build_chart():
+    # 建立空白圖表骨架，每個 session 每檔標的只建立一次
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3], vertical_spacing=0.03)
+    fig.add_trace(go.Candlestick(name="K"), row=1, col=1)
+    fig.add_hline(y=0, line_dash="dash", line_color="red", annotation_text="壓", row=1, col=1)
+    fig.add_hline(y=0, line_dash="dash", line_color="green", annotation_text="支", row=1, col=1)
+    fig.add_trace(go.Scattergl(name="Fast", line=dict(color='orange', width=1)), row=1, col=1)
+    fig.add_trace(go.Bar(), row=2, col=1)
+    fig.update_layout(height=350, margin=dict(t=0, b=0), xaxis_rangeslider_visible=False, showlegend=False)
+    return fig
+
+def volume_colors(sym, df):
+    # 修正：根據收盤/開盤價決定成交量顏色；沿用上次結果，只重算仍可能變動的尾端K棒
+    key = f"vc_{sym}"
+    state = st.session_state.get(key)
+    closes, opens = df['Close'].to_numpy(), df['Open'].to_numpy()
+    same_start = state is not None and state[0] == df.index[0]
+    if same_start and state[1] == df.index[-1] and len(state[2]) == len(df):
+        vc = state[2].copy()
+        vc[-1:] = np.where(closes[-1:] < opens[-1:], '#ef5350', '#26a69a')
+    elif same_start and len(df) > 1 and state[1] == df.index[-2] and len(state[2]) == len(df) - 1:
+        # 上次的最後一根已收定，與新K棒一起重算
+        vc = np.concatenate([state[2][:-1], np.where(closes[-2:] < opens[-2:], '#ef5350', '#26a69a')])
+    else:
+        vc = np.where(closes < opens, '#ef5350', '#26a69a')
+    st.session_state[key] = (df.index[0], df.index[-1], vc)
+    return vc
+
+def update_chart(fig, sym, df, ema_fast_val, res, sup):
+    # 只替換既有 trace 的資料與支撐壓力線位置，不重建整張圖
+    sl = slice(-120, None)  # 只繪製最近 120 根K棒，直接傳入陣列切片
+    idx = df.index[sl]
+    ema_f_array = compute_plot_series(df, ema_fast_val)[sl]
+    v_colors = volume_colors(sym, df)[sl]
+
+    k_trace, ema_trace, vol_trace = fig.data
+    with fig.batch_update():
+        k_trace.update(x=idx, open=df['Open'].to_numpy()[sl], high=df['High'].to_numpy()[sl],
+                       low=df['Low'].to_numpy()[sl], close=df['Close'].to_numpy()[sl])
+        ema_trace.update(x=idx, y=ema_f_array)
+        vol_trace.update(x=idx, y=df['Volume'].to_numpy()[sl], marker_color=v_colors)
+        for shape, note, level in zip(fig.layout.shapes, fig.layout.annotations, (res, sup)):
+            shape.update(y0=level, y1=level)
+            note.update(y=level)
+    return fig
 
 # --- 介面配置 ---
 st.sidebar.header("監控參數")
@@ -134,65 +269,60 @@ interval = st.sidebar.selectbox("頻率", ("1m", "2m", "5m","15m","30m"), index=
 ema_f_v = st.sidebar.slider("快速 EMA", 5, 20, 9)
 ema_s_v = st.sidebar.slider("慢速 EMA", 21, 50, 21)
 
-placeholder = st.empty()
-
-while True:
-    with placeholder.container():
-        # VIX 狀態
-        v_val, v_chg = get_vix_info()
-        v_col1, v_col2 = st.columns([1, 4])
-        v_col1.metric("VIX 指數", f"{v_val:.2f}", f"{v_chg:.2f}", delta_color="inverse")
-        with v_col2:
-            st.info(f"系統環境：VIX {'上升中，建議保守' if v_chg > 0 else '平穩，有利技術面操作'}")
-
-        # 1. 強化版即時警報摘要
-        st.subheader("🔔 即時警報摘要 (含異常波動監控)")
-        cols = st.columns(len(symbols))
-        stock_data_store = {}
-
-        for idx, sym in enumerate(symbols):
-            df_raw = fetch_data(sym, interval)
-            df, info = analyze_stock(df_raw, v_chg, ema_f_v, ema_s_v)
-            stock_data_store[sym] = (df, info)
-            
-            with cols[idx]:
-                if info:
-                    if info['alert_level'] == "error": st.error(f"**{sym} | {info['msg']}**")
-                    elif info['alert_level'] == "warning": st.warning(f"**{sym} | {info['msg']}**")
-                    else: st.success(f"**{sym} | 監控中**")
-                    
-                    # 注入關鍵資訊內容，增加瞬時漲跌幅顯示
-                    st.markdown(f"**量能:** {info['vol_status']} ({info['vol_ratio']:.1f}x)")
-                    st.markdown(f"**瞬時:** {info['price_chg_1bar']:+.2f}%　**日內:** {info['price_chg_day']:+.2f}%{info.get('anomaly_text','')}")
-                    st.caption(f"RSI: {info['rsi']:.1f} | 價: {info['price']:.2f}")
-                else:
-                    st.write(f"{sym} 載入失敗")
-
-        st.divider()
-        
-        # 2. 詳細圖表區
-        for sym in symbols:
-            df, info = stock_data_store[sym]
-            if df is not None:
-                with st.expander(f"查看 {sym} 詳情分析圖表", expanded=True):
-                    c1, c2 = st.columns([1, 4])
-                    with c1:
-                        st.metric("當前價格", f"{info['price']:.2f}", f"{info['day_pct']:.2f}%")
-                        st.write(f"壓力位: `{info['res']:.2f}`")
-                        st.write(f"支撐位: `{info['sup']:.2f}`")
-                        st.write(f"當前趨勢: \n**{info['trend']}**") # 移到側邊增加可讀性
-                    with c2:
-                        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3], vertical_spacing=0.03)
-                        fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'], name="K"), row=1, col=1)
-                        fig.add_hline(y=info['res'], line_dash="dash", line_color="red", annotation_text="壓", row=1, col=1)
-                        fig.add_hline(y=info['sup'], line_dash="dash", line_color="green", annotation_text="支", row=1, col=1)
-                        fig.add_trace(go.Scatter(x=df.index, y=df['EMA_F'], name="Fast", line=dict(color='orange', width=1)), row=1, col=1)
-                        
-                        # 修正：根據收盤/開盤價決定成交量顏色
-                        v_colors = ['#ef5350' if df['Close'].iloc[i] < df['Open'].iloc[i] else '#26a69a' for i in range(len(df))]
-                        fig.add_trace(go.Bar(x=df.index, y=df['Volume'], marker_color=v_colors), row=2, col=1)
-                        fig.update_layout(height=350, margin=dict(t=0, b=0), xaxis_rangeslider_visible=False, showlegend=False)
-                        st.plotly_chart(fig, use_container_width=True)
-
-        time.sleep(60)
-        st.rerun()
+# 每 60 秒只重跑儀表板片段，側邊欄與其餘頁面不隨之重建
+@st.fragment(run_every=60)
+def render_dashboard():
+    # 一次批次下載所有標的與 VIX，避免逐檔發出請求
+    raw = fetch_with_cooldown(tuple(symbols + ["^VIX"]), interval)
+
+    # VIX 狀態
+    v_val, v_chg = get_vix_info(raw["^VIX"])
+    v_col1, v_col2 = st.columns([1, 4])
+    v_col1.metric("VIX 指數", f"{v_val:.2f}", f"{v_chg:.2f}", delta_color="inverse")
+    with v_col2:
+        st.info(f"系統環境：VIX {'上升中，建議保守' if v_chg > 0 else '平穩，有利技術面操作'}")
+
+    # 1. 強化版即時警報摘要
+    st.subheader("🔔 即時警報摘要 (含異常波動監控)")
+    cols = st.columns(len(symbols))
+    stock_data_store = {}
+
+    for idx, sym in enumerate(symbols):
+        df_raw = raw[sym]
+        high_p, low_p = update_high_low(sym, df_raw)
+        info = analyze_stock_summary(df_raw, high_p, low_p, v_chg, ema_f_v, ema_s_v)
+        stock_data_store[sym] = (df_raw, info)
+
+        with cols[idx]:
+            if info:
+                if info['alert_level'] == "error": st.error(f"**{sym} | {info['msg']}**")
+                elif info['alert_level'] == "warning": st.warning(f"**{sym} | {info['msg']}**")
+                else: st.success(f"**{sym} | 監控中**")
+
+                # 注入關鍵資訊內容，增加瞬時漲跌幅顯示
+                st.markdown(f"**量能:** {info['vol_status']} ({info['vol_ratio']:.1f}x)")
+                st.markdown(f"**瞬時:** {info['price_chg_1bar']:+.2f}%　**日內:** {info['price_chg_day']:+.2f}%{info.get('anomaly_text','')}")
+                st.caption(f"RSI: {info['rsi']:.1f} | 價: {info['price']:.2f}")
+            else:
+                st.write(f"{sym} 載入失敗")
+
+    st.divider()
+
+    # 2. 詳細圖表區
+    for sym in symbols:
+        df, info = stock_data_store[sym]
+        if info is not None:
+            with st.expander(f"查看 {sym} 詳情分析圖表", expanded=True):
+                c1, c2 = st.columns([1, 4])
+                with c1:
+                    st.metric("當前價格", f"{info['price']:.2f}", f"{info['day_pct']:.2f}%")
+                    st.write(f"壓力位: `{info['res']:.2f}`")
+                    st.write(f"支撐位: `{info['sup']:.2f}`")
+                    st.write(f"當前趨勢: \n**{info['trend']}**") # 移到側邊增加可讀性
+                with c2:
+                    if f"fig_{sym}" not in st.session_state:
+                        st.session_state[f"fig_{sym}"] = build_chart()
+                    fig = update_chart(st.session_state[f"fig_{sym}"], sym, df, ema_f_v, info['res'], info['sup'])
+                    st.plotly_chart(fig, use_container_width=True, key=f"chart_{sym}")
+
+render_dashboard()